@@ -0,0 +1,304 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+# distutils: extra_compile_args = -O3 -ftree-vectorize
+
+### Native versions of the BTI block decoders and the Yaz0 decompressor from extract_bti.py.
+### extract_bti.py uses this module automatically if it has been built, which can be done with:
+###   cythonize -i _bti_fast.pyx
+
+ctypedef unsigned char u8
+
+# Block width, block height and block data size for each image format, indexed by ImageFormat value.
+# Formats that don't exist have a block width of 0.
+cdef int[15][3] BLOCK_INFO
+BLOCK_INFO[:] = [
+  [8, 8, 32], # I4
+  [8, 4, 32], # I8
+  [8, 4, 32], # IA4
+  [4, 4, 32], # IA8
+  [4, 4, 32], # RGB565
+  [4, 4, 32], # RGB5A3
+  [4, 4, 64], # RGBA32
+  [0, 0, 0],
+  [8, 8, 32], # C4
+  [8, 4, 32], # C8
+  [4, 4, 32], # C14X2
+  [0, 0, 0],
+  [0, 0, 0],
+  [0, 0, 0],
+  [8, 8, 32], # CMPR
+]
+
+cdef inline u8 swizzle3(unsigned int v) noexcept nogil:
+  return (v << 5) | (v << 2) | (v >> 1)
+
+cdef inline u8 swizzle4(unsigned int v) noexcept nogil:
+  return (v << 4) | v
+
+cdef inline u8 swizzle5(unsigned int v) noexcept nogil:
+  return (v << 3) | (v >> 2)
+
+cdef inline u8 swizzle6(unsigned int v) noexcept nogil:
+  return (v << 2) | (v >> 4)
+
+cdef inline unsigned int read_u16(const u8* src) noexcept nogil:
+  return (src[0] << 8) | src[1]
+
+cdef inline void set_color(u8* pixel, u8 r, u8 g, u8 b, u8 a) noexcept nogil:
+  pixel[0] = r
+  pixel[1] = g
+  pixel[2] = b
+  pixel[3] = a
+
+cdef inline void set_palette_color(u8* pixel, const u8* colors, Py_ssize_t num_colors, unsigned int color_index) noexcept nogil:
+  if color_index >= num_colors:
+    # This block bleeds past the edge of the image
+    set_color(pixel, 0, 0, 0, 0)
+  else:
+    set_color(pixel, colors[color_index*4], colors[color_index*4+1], colors[color_index*4+2], colors[color_index*4+3])
+
+cdef inline void set_rgb565_color(u8* pixel, unsigned int rgb565) noexcept nogil:
+  set_color(pixel, swizzle5((rgb565 >> 11) & 0x1F), swizzle6((rgb565 >> 5) & 0x3F), swizzle5(rgb565 & 0x1F), 255)
+
+# Each decoder reads one block from src and writes it to out, which points to the block's top left
+# pixel in an RGBA image whose rows are row_stride bytes apart.
+
+cdef void decode_i4_block(const u8* src, const u8* colors, Py_ssize_t num_colors, u8* out, Py_ssize_t row_stride) noexcept nogil:
+  cdef int x, y, i
+  cdef u8 v
+  for y in range(8):
+    for x in range(8):
+      i = y*8 + x
+      v = swizzle4((src[i//2] >> (1-i%2)*4) & 0xF)
+      set_color(out + y*row_stride + x*4, v, v, v, v)
+
+cdef void decode_i8_block(const u8* src, const u8* colors, Py_ssize_t num_colors, u8* out, Py_ssize_t row_stride) noexcept nogil:
+  cdef int x, y
+  cdef u8 v
+  for y in range(4):
+    for x in range(8):
+      v = src[y*8 + x]
+      set_color(out + y*row_stride + x*4, v, v, v, v)
+
+cdef void decode_ia4_block(const u8* src, const u8* colors, Py_ssize_t num_colors, u8* out, Py_ssize_t row_stride) noexcept nogil:
+  cdef int x, y
+  cdef u8 ia4, v
+  for y in range(4):
+    for x in range(8):
+      ia4 = src[y*8 + x]
+      v = swizzle4(ia4 & 0xF)
+      set_color(out + y*row_stride + x*4, v, v, v, swizzle4((ia4 >> 4) & 0xF))
+
+cdef void decode_ia8_block(const u8* src, const u8* colors, Py_ssize_t num_colors, u8* out, Py_ssize_t row_stride) noexcept nogil:
+  cdef int x, y
+  cdef const u8* ia8
+  for y in range(4):
+    for x in range(4):
+      ia8 = src + (y*4 + x)*2
+      set_color(out + y*row_stride + x*4, ia8[1], ia8[1], ia8[1], ia8[0])
+
+cdef void decode_rgb565_block(const u8* src, const u8* colors, Py_ssize_t num_colors, u8* out, Py_ssize_t row_stride) noexcept nogil:
+  cdef int x, y
+  for y in range(4):
+    for x in range(4):
+      set_rgb565_color(out + y*row_stride + x*4, read_u16(src + (y*4 + x)*2))
+
+cdef void decode_rgb5a3_block(const u8* src, const u8* colors, Py_ssize_t num_colors, u8* out, Py_ssize_t row_stride) noexcept nogil:
+  cdef int x, y
+  cdef unsigned int rgb5a3
+  for y in range(4):
+    for x in range(4):
+      rgb5a3 = read_u16(src + (y*4 + x)*2)
+      if (rgb5a3 & 0x8000) == 0:
+        set_color(
+          out + y*row_stride + x*4,
+          swizzle4((rgb5a3 >> 8) & 0xF), swizzle4((rgb5a3 >> 4) & 0xF), swizzle4(rgb5a3 & 0xF),
+          swizzle3((rgb5a3 >> 12) & 0x7),
+        )
+      else:
+        set_color(
+          out + y*row_stride + x*4,
+          swizzle5((rgb5a3 >> 10) & 0x1F), swizzle5((rgb5a3 >> 5) & 0x1F), swizzle5(rgb5a3 & 0x1F),
+          255,
+        )
+
+cdef void decode_rgba32_block(const u8* src, const u8* colors, Py_ssize_t num_colors, u8* out, Py_ssize_t row_stride) noexcept nogil:
+  cdef int i
+  for i in range(16):
+    set_color(out + (i//4)*row_stride + (i%4)*4, src[i*2+1], src[i*2+32], src[i*2+33], src[i*2])
+
+cdef void decode_c4_block(const u8* src, const u8* colors, Py_ssize_t num_colors, u8* out, Py_ssize_t row_stride) noexcept nogil:
+  cdef int x, y, i
+  for y in range(8):
+    for x in range(8):
+      i = y*8 + x
+      set_palette_color(out + y*row_stride + x*4, colors, num_colors, (src[i//2] >> (1-i%2)*4) & 0xF)
+
+cdef void decode_c8_block(const u8* src, const u8* colors, Py_ssize_t num_colors, u8* out, Py_ssize_t row_stride) noexcept nogil:
+  cdef int x, y
+  for y in range(4):
+    for x in range(8):
+      set_palette_color(out + y*row_stride + x*4, colors, num_colors, src[y*8 + x])
+
+cdef void decode_c14x2_block(const u8* src, const u8* colors, Py_ssize_t num_colors, u8* out, Py_ssize_t row_stride) noexcept nogil:
+  cdef int x, y
+  for y in range(4):
+    for x in range(4):
+      set_palette_color(out + y*row_stride + x*4, colors, num_colors, read_u16(src + (y*4 + x)*2) & 0x3FFF)
+
+cdef void decode_cmpr_block(const u8* src, const u8* colors, Py_ssize_t num_colors, u8* out, Py_ssize_t row_stride) noexcept nogil:
+  cdef int subblock_index, i, c
+  cdef unsigned int color_0_rgb565, color_1_rgb565, color_indexes
+  cdef u8[4][4] cmpr_colors
+  cdef u8* subblock_out
+  for subblock_index in range(4):
+    color_0_rgb565 = read_u16(src)
+    color_1_rgb565 = read_u16(src+2)
+    set_rgb565_color(cmpr_colors[0], color_0_rgb565)
+    set_rgb565_color(cmpr_colors[1], color_1_rgb565)
+    if color_0_rgb565 > color_1_rgb565:
+      for c in range(3):
+        cmpr_colors[2][c] = (2*cmpr_colors[0][c] + 1*cmpr_colors[1][c])//3
+        cmpr_colors[3][c] = (1*cmpr_colors[0][c] + 2*cmpr_colors[1][c])//3
+      cmpr_colors[2][3] = 255
+      cmpr_colors[3][3] = 255
+    else:
+      for c in range(3):
+        cmpr_colors[2][c] = cmpr_colors[0][c]//2 + cmpr_colors[1][c]//2
+      cmpr_colors[2][3] = 255
+      set_color(cmpr_colors[3], 0, 0, 0, 0)
+
+    color_indexes = (read_u16(src+4) << 16) | read_u16(src+6)
+    subblock_out = out + (subblock_index//2)*4*row_stride + (subblock_index%2)*4*4
+    for i in range(16):
+      c = (color_indexes >> ((15-i)*2)) & 3
+      set_color(
+        subblock_out + (i//4)*row_stride + (i%4)*4,
+        cmpr_colors[c][0], cmpr_colors[c][1], cmpr_colors[c][2], cmpr_colors[c][3],
+      )
+
+    src += 8
+
+ctypedef void (*block_decoder)(const u8*, const u8*, Py_ssize_t, u8*, Py_ssize_t) noexcept nogil
+
+cdef block_decoder get_block_decoder(int image_format) noexcept nogil:
+  if image_format == 0x0:
+    return decode_i4_block
+  elif image_format == 0x1:
+    return decode_i8_block
+  elif image_format == 0x2:
+    return decode_ia4_block
+  elif image_format == 0x3:
+    return decode_ia8_block
+  elif image_format == 0x4:
+    return decode_rgb565_block
+  elif image_format == 0x5:
+    return decode_rgb5a3_block
+  elif image_format == 0x6:
+    return decode_rgba32_block
+  elif image_format == 0x8:
+    return decode_c4_block
+  elif image_format == 0x9:
+    return decode_c8_block
+  elif image_format == 0xA:
+    return decode_c14x2_block
+  elif image_format == 0xE:
+    return decode_cmpr_block
+  return NULL
+
+def decode_image_into(const u8[::1] image_data, int image_format, const u8[:, ::1] colors, u8[:, :, ::1] out):
+  # out must be padded to a whole number of blocks in both dimensions.
+  cdef block_decoder decode_block = NULL
+  if 0 <= image_format < 15:
+    decode_block = get_block_decoder(image_format)
+  if decode_block == NULL:
+    raise ValueError("Unknown image format: %s" % image_format)
+
+  cdef int block_width = BLOCK_INFO[image_format][0]
+  cdef int block_height = BLOCK_INFO[image_format][1]
+  cdef int block_data_size = BLOCK_INFO[image_format][2]
+  cdef Py_ssize_t blocks_wide = out.shape[1] // block_width
+  cdef Py_ssize_t blocks_tall = out.shape[0] // block_height
+  if blocks_wide == 0 or blocks_tall == 0:
+    return
+  if image_data.shape[0] < blocks_wide*blocks_tall*block_data_size:
+    raise ValueError("Image data is too short for a %dx%d block image" % (blocks_wide, blocks_tall))
+
+  cdef const u8* palette = &colors[0, 0] if colors.shape[0] > 0 else NULL
+  cdef Py_ssize_t num_colors = colors.shape[0]
+  cdef Py_ssize_t row_stride = out.shape[1]*4
+  cdef const u8* src = &image_data[0]
+  cdef u8* dst = &out[0, 0, 0]
+  cdef Py_ssize_t block_x, block_y
+  with nogil:
+    for block_y in range(blocks_tall):
+      for block_x in range(blocks_wide):
+        decode_block(src, palette, num_colors, dst + block_y*block_height*row_stride + block_x*block_width*4, row_stride)
+        src += block_data_size
+
+def yaz0_decompress(const u8[::1] comp, Py_ssize_t uncomp_size):
+  output = bytearray(uncomp_size)
+  if uncomp_size == 0:
+    return bytes(output)
+
+  cdef u8* out = output
+  cdef Py_ssize_t comp_size = comp.shape[0]
+  cdef Py_ssize_t output_len = 0
+  cdef Py_ssize_t src_offset = 0x10
+  cdef Py_ssize_t copy_src_offset, num_bytes, dist
+  cdef int valid_bit_count = 0
+  cdef unsigned int curr_code_byte = 0
+  cdef unsigned int byte1, byte2
+  cdef bint malformed = False
+  with nogil:
+    while output_len < uncomp_size:
+      if valid_bit_count == 0:
+        if src_offset >= comp_size:
+          malformed = True
+          break
+        curr_code_byte = comp[src_offset]
+        src_offset += 1
+        valid_bit_count = 8
+
+      if curr_code_byte & 0x80 != 0:
+        if src_offset >= comp_size:
+          malformed = True
+          break
+        out[output_len] = comp[src_offset]
+        src_offset += 1
+        output_len += 1
+      else:
+        if src_offset+1 >= comp_size:
+          malformed = True
+          break
+        byte1 = comp[src_offset]
+        byte2 = comp[src_offset+1]
+        src_offset += 2
+
+        dist = ((byte1&0xF) << 8) | byte2
+        copy_src_offset = output_len - (dist + 1)
+        num_bytes = (byte1 >> 4)
+        if num_bytes == 0:
+          if src_offset >= comp_size:
+            malformed = True
+            break
+          num_bytes = comp[src_offset] + 0x12
+          src_offset += 1
+        else:
+          num_bytes += 2
+
+        if copy_src_offset < 0 or output_len + num_bytes > uncomp_size:
+          malformed = True
+          break
+        # Copied one byte at a time since the source and destination can overlap
+        while num_bytes > 0:
+          out[output_len] = out[copy_src_offset]
+          output_len += 1
+          copy_src_offset += 1
+          num_bytes -= 1
+
+      curr_code_byte = (curr_code_byte << 1)
+      valid_bit_count -= 1
+
+  if malformed:
+    raise ValueError("Malformed Yaz0 data")
+  return bytes(output)
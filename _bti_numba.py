@@ -0,0 +1,48 @@
+### A Numba-compiled version of the Yaz0 decompressor from extract_bti.py.
+### Importing Numba takes longer than decompressing most files without it, so extract_bti.py only imports
+### this module for files that are big enough for it to pay off.
+
+from numba import njit
+import numpy as np
+
+# Bounds checking turns malformed compressed data into an IndexError rather than an out of bounds read or write.
+@njit(cache=True, boundscheck=True)
+def decompress_yaz0(comp, uncomp_size):
+  output = np.empty(uncomp_size, dtype=np.uint8)
+  output_len = 0
+  src_offset = 0x10
+  valid_bit_count = 0
+  curr_code_byte = 0
+  while output_len < uncomp_size:
+    if valid_bit_count == 0:
+      curr_code_byte = int(comp[src_offset])
+      src_offset += 1
+      valid_bit_count = 8
+    
+    if curr_code_byte & 0x80 != 0:
+      output[output_len] = comp[src_offset]
+      src_offset += 1
+      output_len += 1
+    else:
+      byte1 = int(comp[src_offset])
+      byte2 = int(comp[src_offset+1])
+      src_offset += 2
+      
+      dist = ((byte1&0xF) << 8) | byte2
+      copy_src_offset = output_len - (dist + 1)
+      num_bytes = (byte1 >> 4)
+      if num_bytes == 0:
+        num_bytes = int(comp[src_offset]) + 0x12
+        src_offset += 1
+      else:
+        num_bytes += 2
+      
+      for i in range(0, num_bytes):
+        output[output_len] = output[copy_src_offset]
+        output_len += 1
+        copy_src_offset += 1
+    
+    curr_code_byte = (curr_code_byte << 1)
+    valid_bit_count -= 1
+  
+  return output
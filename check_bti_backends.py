@@ -0,0 +1,127 @@
+### Checks that every available backend in extract_bti.py decodes images and decompresses Yaz0 data identically.
+### Run it after building _bti_fast.pyx or changing any of the decoders:
+###   python3 check_bti_backends.py [seed]
+
+from io import BytesIO
+import random
+import sys
+
+import numpy as np
+
+import extract_bti
+from extract_bti import ImageFormat, PaletteFormat
+
+BACKEND_FLAGS = ["BTI_FAST_INSTALLED", "PY_FAST_YAZ0_INSTALLED", "NUMBA_INSTALLED"]
+AVAILABLE_FLAGS = {flag: getattr(extract_bti, flag) for flag in BACKEND_FLAGS}
+
+def set_backend(flag):
+  # Disables every optional backend except the one given, so extract_bti.py falls through to it.
+  for other_flag in BACKEND_FLAGS:
+    setattr(extract_bti, other_flag, other_flag == flag)
+  extract_bti.YAZ0_NUMBA_MIN_SIZE = 0
+
+def get_image_backends():
+  backends = [("numpy", None)]
+  if AVAILABLE_FLAGS["BTI_FAST_INSTALLED"]:
+    backends.append(("_bti_fast", "BTI_FAST_INSTALLED"))
+  return backends
+
+def get_yaz0_backends():
+  backends = [("python", None)]
+  if AVAILABLE_FLAGS["BTI_FAST_INSTALLED"]:
+    backends.append(("_bti_fast", "BTI_FAST_INSTALLED"))
+  if AVAILABLE_FLAGS["PY_FAST_YAZ0_INSTALLED"]:
+    backends.append(("pyfastyaz0", "PY_FAST_YAZ0_INSTALLED"))
+  if AVAILABLE_FLAGS["NUMBA_INSTALLED"] and extract_bti.try_import_bti_numba() is not None:
+    backends.append(("numba", "NUMBA_INSTALLED"))
+  return backends
+
+def make_random_image(rng, image_format):
+  image_width = rng.randint(1, 70)
+  image_height = rng.randint(1, 70)
+  blocks_wide = (image_width + extract_bti.BLOCK_WIDTHS[image_format] - 1) // extract_bti.BLOCK_WIDTHS[image_format]
+  blocks_tall = (image_height + extract_bti.BLOCK_HEIGHTS[image_format] - 1) // extract_bti.BLOCK_HEIGHTS[image_format]
+  image_data = np.frombuffer(rng.randbytes(blocks_wide*blocks_tall*extract_bti.BLOCK_DATA_SIZES[image_format]), dtype=np.uint8)
+  
+  palette_format = rng.choice(list(PaletteFormat))
+  num_colors = 0
+  if image_format in extract_bti.IMAGE_FORMATS_THAT_USE_PALETTES:
+    # Palettes are often shorter than the format's index range.
+    max_colors = {ImageFormat.C4: 0x10, ImageFormat.C8: 0x100, ImageFormat.C14X2: 0x4000}[image_format]
+    num_colors = rng.randint(1, max_colors)
+  palette_data = memoryview(rng.randbytes(num_colors*2))
+  
+  return (image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height)
+
+def make_random_yaz0(rng):
+  # Builds a random stream of literals and back references, along with the data it decompresses to.
+  uncomp = bytearray()
+  comp = bytearray()
+  num_chunks = rng.randint(0, 2000)
+  for chunk_index in range(num_chunks):
+    code_byte_offset = len(comp)
+    comp.append(0)
+    code_byte = 0
+    for bit in range(8):
+      if len(uncomp) == 0 or rng.random() < 0.5:
+        code_byte |= 0x80 >> bit
+        byte = rng.randrange(0x100)
+        comp.append(byte)
+        uncomp.append(byte)
+        continue
+      
+      dist = rng.randint(1, min(len(uncomp), 0x1000))
+      num_bytes = rng.choice([rng.randint(3, 0x11), rng.randint(0x12, 0x111)])
+      if num_bytes < 0x12:
+        comp += bytes([((num_bytes-2) << 4) | ((dist-1) >> 8), (dist-1) & 0xFF])
+      else:
+        comp += bytes([(dist-1) >> 8, (dist-1) & 0xFF, num_bytes-0x12])
+      # Copies can overlap the bytes they produce, so this has to go one byte at a time.
+      for i in range(num_bytes):
+        uncomp.append(uncomp[-dist])
+    comp[code_byte_offset] = code_byte
+  
+  header = b"Yaz0" + len(uncomp).to_bytes(4, "big") + bytes(8)
+  return header + bytes(comp), bytes(uncomp)
+
+def check_images(rng, num_images_per_format):
+  backends = get_image_backends()
+  print("Image backends: %s" % ", ".join(name for name, flag in backends))
+  num_mismatches = 0
+  for image_format in ImageFormat:
+    for image_index in range(num_images_per_format):
+      args = make_random_image(rng, image_format)
+      results = []
+      for name, flag in backends:
+        set_backend(flag)
+        results.append((name, extract_bti.decode_image(*args).tobytes()))
+      
+      expected_name, expected = results[0]
+      for name, result in results[1:]:
+        if result != expected:
+          num_mismatches += 1
+          print("MISMATCH: %s %dx%d image decoded differently by %s and %s" % (image_format.name, args[5], args[6], expected_name, name))
+  return num_mismatches
+
+def check_yaz0(rng, num_streams):
+  backends = get_yaz0_backends()
+  print("Yaz0 backends: %s" % ", ".join(name for name, flag in backends))
+  num_mismatches = 0
+  for stream_index in range(num_streams):
+    comp, uncomp = make_random_yaz0(rng)
+    for name, flag in backends:
+      set_backend(flag)
+      if extract_bti.Yaz0.decompress(BytesIO(comp)).getvalue() != uncomp:
+        num_mismatches += 1
+        print("MISMATCH: Yaz0 stream of 0x%X bytes decompressed incorrectly by %s" % (len(uncomp), name))
+  return num_mismatches
+
+if __name__ == '__main__':
+  seed = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+  rng = random.Random(seed)
+  
+  num_mismatches = check_images(rng, 20) + check_yaz0(rng, 20)
+  if num_mismatches != 0:
+    print("%d mismatches found (seed %d)." % (num_mismatches, seed))
+    sys.exit(1)
+  print("All backends match (seed %d)." % seed)
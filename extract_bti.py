@@ -5,8 +5,23 @@
 from io import BytesIO
 from enum import Enum
 from PIL import Image
+import importlib.util
+import math
+import numpy as np
+import os
 import struct
 import sys
+import traceback
+
+# Importing Numba takes longer than decompressing most files without it, so only check whether it's installed here.
+# _bti_numba, which imports it, is imported when a file big enough for it to pay off comes along.
+NUMBA_INSTALLED = importlib.util.find_spec("numba") is not None
+
+try:
+  import _bti_fast
+  BTI_FAST_INSTALLED = True
+except ImportError:
+  BTI_FAST_INSTALLED = False
 
 class WrapMode(Enum):
   ClampToEdge    = 0
@@ -21,6 +36,9 @@ class FilterMode(Enum):
   LinearMipmapNearest  = 4
   LinearMipmapLinear   = 5
 
+BTI_HEADER_FORMAT = ">BBHHBBBBHI4xBBBBBBHI"
+BTI_HEADER_SIZE = struct.calcsize(BTI_HEADER_FORMAT)
+
 class BTI:
   def __init__(self, data, header_offset=0):
     self.data = data
@@ -31,45 +49,38 @@ class BTI:
     blocks_wide = (self.width + (self.block_width-1)) // self.block_width
     blocks_tall = (self.height + (self.block_height-1)) // self.block_height
     image_data_size = blocks_wide*blocks_tall*self.block_data_size
-    remaining_mipmaps = self.mipmap_count-1
     curr_mipmap_size = image_data_size
-    while remaining_mipmaps > 0:
+    for _ in range(self.mipmap_count-1):
       # Each mipmap is a quarter the size of the last (half the width and half the height).
-      curr_mipmap_size = curr_mipmap_size//4
+      curr_mipmap_size //= 4
       image_data_size += curr_mipmap_size
-      remaining_mipmaps -= 1
       # Note: We don't actually read the smaller mipmaps, we only read the normal sized one, and when saving recalculate the others by scaling the normal one down.
       # This is to simplify things, but a full implementation would allow reading and saving each mipmap individually (since the mipmaps can actually have different contents).
-    self.image_data = BytesIO(read_bytes(data, header_offset+self.image_data_offset, image_data_size))
+    self.image_data = np.frombuffer(read_bytes(data, header_offset+self.image_data_offset, image_data_size), dtype=np.uint8)
     
     palette_data_size = self.num_colors*2
-    self.palette_data = BytesIO(read_bytes(data, header_offset+self.palette_data_offset, palette_data_size))
+    self.palette_data = memoryview(read_bytes(data, header_offset+self.palette_data_offset, palette_data_size))
   
   def read_header(self, data, header_offset=0):
-    self.image_format = ImageFormat(read_u8(data, header_offset+0))
-    
-    self.alpha_setting = read_u8(data, header_offset+1)
-    self.width = read_u16(data, header_offset+2)
-    self.height = read_u16(data, header_offset+4)
-    
-    self.wrap_s = WrapMode(read_u8(data, header_offset+6))
-    self.wrap_t = WrapMode(read_u8(data, header_offset+7))
-    
-    self.palettes_enabled = bool(read_u8(data, header_offset+8))
-    self.palette_format = PaletteFormat(read_u8(data, header_offset+9))
-    self.num_colors = read_u16(data, header_offset+0xA)
-    self.palette_data_offset = read_u32(data, header_offset+0xC)
+    (
+      image_format, self.alpha_setting, self.width, self.height,
+      wrap_s, wrap_t,
+      palettes_enabled, palette_format, self.num_colors, self.palette_data_offset,
+      # 0x10-0x13 are unused
+      min_filter, mag_filter,
+      self.min_lod,
+      self.max_lod, # seems to be equal to (mipmap_count-1)*8
+      self.mipmap_count, self.unknown_3, self.lod_bias,
+      self.image_data_offset,
+    ) = struct.unpack(BTI_HEADER_FORMAT, read_bytes(data, header_offset, BTI_HEADER_SIZE))
     
-    self.min_filter = FilterMode(read_u8(data, header_offset+0x14))
-    self.mag_filter = FilterMode(read_u8(data, header_offset+0x15))
-    
-    self.min_lod = read_u8(data, header_offset+0x16)
-    self.max_lod = read_u8(data, header_offset+0x17) # seems to be equal to (mipmap_count-1)*8
-    self.mipmap_count = read_u8(data, header_offset+0x18)
-    self.unknown_3 = read_u8(data, header_offset+0x19)
-    self.lod_bias = read_u16(data, header_offset+0x1A)
-    
-    self.image_data_offset = read_u32(data, header_offset+0x1C)
+    self.image_format = ImageFormat(image_format)
+    self.wrap_s = WrapMode(wrap_s)
+    self.wrap_t = WrapMode(wrap_t)
+    self.palettes_enabled = bool(palettes_enabled)
+    self.palette_format = PaletteFormat(palette_format)
+    self.min_filter = FilterMode(min_filter)
+    self.mag_filter = FilterMode(mag_filter)
   
   @property
   def block_width(self):
@@ -165,76 +176,24 @@ IMAGE_FORMATS_THAT_USE_PALETTES = [
   ImageFormat.C14X2,
 ]
 
-def swizzle_3_bit_to_8_bit(v):
-  # 00000123 -> 12312312
-  return (v << 5) | (v << 2) | (v >> 1)
-
 def swizzle_4_bit_to_8_bit(v):
   # 00001234 -> 12341234
   return (v << 4) | (v >> 0)
 
-def swizzle_5_bit_to_8_bit(v):
-  # 00012345 -> 12345123
-  return (v << 3) | (v >> 2)
-
-def swizzle_6_bit_to_8_bit(v):
-  # 00123456 -> 12345612
-  return (v << 2) | (v >> 4)
-
-def convert_rgb565_to_color(rgb565):
-  r = ((rgb565 >> 11) & 0x1F)
-  g = ((rgb565 >> 5) & 0x3F)
-  b = ((rgb565 >> 0) & 0x1F)
-  r = swizzle_5_bit_to_8_bit(r)
-  g = swizzle_6_bit_to_8_bit(g)
-  b = swizzle_5_bit_to_8_bit(b)
-  return (r, g, b, 255)
-
-def convert_rgb5a3_to_color(rgb5a3):
-  # RGB5A3 format.
-  # Each color takes up two bytes.
-  # Format depends on the most significant bit. Two possible formats:
-  # Top bit is 0: 0AAARRRRGGGGBBBB
-  # Top bit is 1: 1RRRRRGGGGGBBBBB (Alpha set to 0xff)
-  if (rgb5a3 & 0x8000) == 0:
-    a = ((rgb5a3 >> 12) & 0x7)
-    r = ((rgb5a3 >> 8) & 0xF)
-    g = ((rgb5a3 >> 4) & 0xF)
-    b = ((rgb5a3 >> 0) & 0xF)
-    a = swizzle_3_bit_to_8_bit(a)
-    r = swizzle_4_bit_to_8_bit(r)
-    g = swizzle_4_bit_to_8_bit(g)
-    b = swizzle_4_bit_to_8_bit(b)
-  else:
-    a = 255
-    r = ((rgb5a3 >> 10) & 0x1F)
-    g = ((rgb5a3 >> 5) & 0x1F)
-    b = ((rgb5a3 >> 0) & 0x1F)
-    r = swizzle_5_bit_to_8_bit(r)
-    g = swizzle_5_bit_to_8_bit(g)
-    b = swizzle_5_bit_to_8_bit(b)
-  return (r, g, b, a)
+# Lookup table holding the result of swizzle_4_bit_to_8_bit for every possible input.
+LUT4 = bytes(swizzle_4_bit_to_8_bit(v) for v in range(16))
 
 def convert_ia4_to_color(ia4):
   low_nibble = ia4 & 0xF
   high_nibble = (ia4 >> 4) & 0xF
   
-  r = g = b = swizzle_4_bit_to_8_bit(low_nibble)
-  a = swizzle_4_bit_to_8_bit(high_nibble)
-  
-  return (r, g, b, a)
-
-def convert_ia8_to_color(ia8):
-  low_byte = ia8 & 0xFF
-  high_byte = (ia8 >> 8) & 0xFF
-  
-  r = g = b = low_byte
-  a = high_byte
+  r = g = b = LUT4[low_nibble]
+  a = LUT4[high_nibble]
   
   return (r, g, b, a)
 
 def convert_i4_to_color(i4):
-  r = g = b = a = swizzle_4_bit_to_8_bit(i4)
+  r = g = b = a = LUT4[i4]
   
   return (r, g, b, a)
 
@@ -243,30 +202,6 @@ def convert_i8_to_color(i8):
   
   return (r, g, b, a)
 
-def get_interpolated_cmpr_colors(color_0_rgb565, color_1_rgb565):
-  color_0 = convert_rgb565_to_color(color_0_rgb565)
-  color_1 = convert_rgb565_to_color(color_1_rgb565)
-  r0, g0, b0, _ = color_0
-  r1, g1, b1, _ = color_1
-  if color_0_rgb565 > color_1_rgb565:
-    color_2 = (
-      (2*r0 + 1*r1)//3,
-      (2*g0 + 1*g1)//3,
-      (2*b0 + 1*b1)//3,
-      255
-    )
-    color_3 = (
-      (1*r0 + 2*r1)//3,
-      (1*g0 + 2*g1)//3,
-      (1*b0 + 2*b1)//3,
-      255
-    )
-  else:
-    color_2 = (r0//2+r1//2, g0//2+g1//2, b0//2+b1//2, 255)
-    color_3 = (0, 0, 0, 0)
-  colors = [color_0, color_1, color_2, color_3]
-  return colors
-
 def average_colors_together(colors):
   transparent_color = next(((r,g,b,a) for r,g,b,a in colors if a == 0), None)
   if transparent_color:
@@ -292,27 +227,10 @@ def decode_palettes(palette_data, palette_format, num_colors, image_format):
   if not isinstance(image_format, ImageFormat):
     raise Exception("Invalid image format: %s" % image_format)
   if image_format not in IMAGE_FORMATS_THAT_USE_PALETTES:
-    return []
-  
-  colors = []
-  offset = 0
-  for i in range(num_colors):
-    raw_color = read_u16(palette_data, offset)
-    color = decode_color(raw_color, palette_format)
-    colors.append(color)
-    offset += 2
-  
-  return colors
-
-def decode_color(raw_color, palette_format):
-  if palette_format == PaletteFormat.IA8:
-    color = convert_ia8_to_color(raw_color)
-  elif palette_format == PaletteFormat.RGB565:
-    color = convert_rgb565_to_color(raw_color)
-  elif palette_format == PaletteFormat.RGB5A3:
-    color = convert_rgb5a3_to_color(raw_color)
+    return np.zeros((0, 4), dtype=np.uint8)
   
-  return color
+  raw_colors = np.frombuffer(palette_data, dtype=">u2", count=num_colors)
+  return PALETTE_FORMAT_LUTS[palette_format][raw_colors]
 
 def decode_image(image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height):
   colors = decode_palettes(palette_data, palette_format, num_colors, image_format)
@@ -321,213 +239,182 @@ def decode_image(image_data, palette_data, image_format, palette_format, num_col
   block_height = BLOCK_HEIGHTS[image_format]
   block_data_size = BLOCK_DATA_SIZES[image_format]
   
-  image = Image.new("RGBA", (image_width, image_height), (0, 0, 0, 0))
-  pixels = image.load()
-  offset = 0
-  block_x = 0
-  block_y = 0
-  while block_y < image_height:
-    pixel_color_data = decode_block(image_format, image_data, offset, block_data_size, colors)
-    
-    for i, color in enumerate(pixel_color_data):
-      x_in_block = i % block_width
-      y_in_block = i // block_width
-      x = block_x+x_in_block
-      y = block_y+y_in_block
-      if x >= image_width or y >= image_height:
-        continue
-      
-      pixels[x,y] = color
-    
-    offset += block_data_size
-    block_x += block_width
-    if block_x >= image_width:
-      block_x = 0
-      block_y += block_height
+  # Blocks on the right and bottom edges can bleed past the edge of the image, so decode into
+  # a buffer padded out to a whole number of blocks.
+  blocks_wide = (image_width + (block_width-1)) // block_width
+  blocks_tall = (image_height + (block_height-1)) // block_height
+  image_pixels = np.empty((blocks_tall*block_height, blocks_wide*block_width, 4), dtype=np.uint8)
+  
+  # The native decoders don't check their reads against the end of the image data.
+  image_data_size = blocks_wide*blocks_tall*block_data_size
+  if len(image_data) < image_data_size:
+    raise InvalidOffsetError("Image data is 0x%X bytes long, but a %dx%d %s image needs 0x%X bytes." % (len(image_data), image_width, image_height, image_format.name, image_data_size))
   
+  if BTI_FAST_INSTALLED:
+    _bti_fast.decode_image_into(image_data, image_format.value, colors, image_pixels)
+  else:
+    # A view of the pixels as (blocks_tall, blocks_wide, block_height, block_width, 4), matching the order the
+    # blocks are stored in, so decoders can write each block in raster order without any copying.
+    blocks = image_pixels.reshape(blocks_tall, block_height, blocks_wide, block_width, 4).transpose(0, 2, 1, 3, 4)
+    VECTORIZED_BLOCK_DECODERS[image_format](image_data, 0, colors, blocks)
+  
+  # Only the top left image_width x image_height pixels of the padded buffer are part of the image.
+  # Passing the buffer's row stride lets PIL map the padded buffer directly instead of it being cropped into a copy.
+  image = Image.frombuffer("RGBA", (image_width, image_height), image_pixels, "raw", "RGBA", image_pixels.strides[0], 1)
   return image
 
-def decode_block(image_format, image_data, offset, block_data_size, colors):
-  if image_format == ImageFormat.I4:
-    return decode_i4_block(image_format, image_data, offset, block_data_size, colors)
-  elif image_format == ImageFormat.I8:
-    return decode_i8_block(image_format, image_data, offset, block_data_size, colors)
-  elif image_format == ImageFormat.IA4:
-    return decode_ia4_block(image_format, image_data, offset, block_data_size, colors)
-  elif image_format == ImageFormat.IA8:
-    return decode_ia8_block(image_format, image_data, offset, block_data_size, colors)
-  elif image_format == ImageFormat.RGB565:
-    return decode_rgb565_block(image_format, image_data, offset, block_data_size, colors)
-  elif image_format == ImageFormat.RGB5A3:
-    return decode_rgb5a3_block(image_format, image_data, offset, block_data_size, colors)
-  elif image_format == ImageFormat.RGBA32:
-    return decode_rgba32_block(image_format, image_data, offset, block_data_size, colors)
-  elif image_format == ImageFormat.C4:
-    return decode_c4_block(image_format, image_data, offset, block_data_size, colors)
-  elif image_format == ImageFormat.C8:
-    return decode_c8_block(image_format, image_data, offset, block_data_size, colors)
-  elif image_format == ImageFormat.C14X2:
-    return decode_c14x2_block(image_format, image_data, offset, block_data_size, colors)
-  elif image_format == ImageFormat.CMPR:
-    return decode_cmpr_block(image_format, image_data, offset, block_data_size, colors)
-  else:
-    raise Exception("Unknown image format: %s" % image_format.name)
+# Block decoders using NumPy array operations, so that no Python code runs per pixel. They accept an out
+# with any number of leading dimensions, so every block in an image can be decoded in one call.
 
-def decode_i4_block(image_format, image_data, offset, block_data_size, colors):
-  pixel_color_data = []
-  
-  for byte_index in range(block_data_size):
-    byte = read_u8(image_data, offset+byte_index)
-    for nibble_index in range(2):
-      i4 = (byte >> (1-nibble_index)*4) & 0xF
-      color = convert_i4_to_color(i4)
-      
-      pixel_color_data.append(color)
-  
-  return pixel_color_data
+def _read_u8_block_vectorized(buf, offset, out):
+  return np.frombuffer(buf, dtype=np.uint8, count=math.prod(out.shape[:-1]), offset=offset).reshape(out.shape[:-1])
 
-def decode_i8_block(image_format, image_data, offset, block_data_size, colors):
-  pixel_color_data = []
-  
-  for i in range(block_data_size):
-    i8 = read_u8(image_data, offset+i)
-    color = convert_i8_to_color(i8)
-    
-    pixel_color_data.append(color)
-  
-  return pixel_color_data
+def _read_u16_block_vectorized(buf, offset, out):
+  return np.frombuffer(buf, dtype=">u2", count=math.prod(out.shape[:-1]), offset=offset).reshape(out.shape[:-1])
 
-def decode_ia4_block(image_format, image_data, offset, block_data_size, colors):
-  pixel_color_data = []
-  
-  for i in range(block_data_size):
-    ia4 = read_u8(image_data, offset+i)
-    color = convert_ia4_to_color(ia4)
-    
-    pixel_color_data.append(color)
-  
-  return pixel_color_data
+def _read_u4_block_vectorized(buf, offset, out):
+  packed = np.frombuffer(buf, dtype=np.uint8, count=math.prod(out.shape[:-1])//2, offset=offset)
+  # The first pixel of each pair is in the high nibble.
+  return np.stack((packed >> 4, packed & 0xF), axis=-1).reshape(out.shape[:-1])
 
-def decode_ia8_block(image_format, image_data, offset, block_data_size, colors):
-  pixel_color_data = []
-  
-  for i in range(block_data_size//2):
-    ia8 = read_u16(image_data, offset+i*2)
-    color = convert_ia8_to_color(ia8)
-    
-    pixel_color_data.append(color)
-  
-  return pixel_color_data
+def _pad_palette_vectorized(colors, num_indexes):
+  # Indexes past the end of the palette come from blocks that bleed past the edge of the image, and decode as 0.
+  padded_colors = np.zeros((max(num_indexes, colors.shape[0]), 4), dtype=np.uint8)
+  padded_colors[:colors.shape[0]] = colors
+  return padded_colors
 
-def decode_rgb565_block(image_format, image_data, offset, block_data_size, colors):
-  pixel_color_data = []
-  
-  for i in range(block_data_size//2):
-    rgb565 = read_u16(image_data, offset+i*2)
-    color = convert_rgb565_to_color(rgb565)
-    
-    pixel_color_data.append(color)
-  
-  return pixel_color_data
+def _convert_ia8_to_colors_vectorized(ia8):
+  colors = np.empty(ia8.shape + (4,), dtype=np.int32)
+  colors[..., 0] = colors[..., 1] = colors[..., 2] = ia8 & 0xFF
+  colors[..., 3] = (ia8 >> 8) & 0xFF
+  return colors
 
-def decode_rgb5a3_block(image_format, image_data, offset, block_data_size, colors):
-  pixel_color_data = []
-  
-  for i in range(block_data_size//2):
-    rgb5a3 = read_u16(image_data, offset+i*2)
-    color = convert_rgb5a3_to_color(rgb5a3)
-    
-    pixel_color_data.append(color)
-  
-  return pixel_color_data
+def _convert_rgb565_to_colors_vectorized(rgb565):
+  colors = np.empty(rgb565.shape + (4,), dtype=np.int32)
+  r = (rgb565 >> 11) & 0x1F
+  g = (rgb565 >> 5) & 0x3F
+  b = (rgb565 >> 0) & 0x1F
+  colors[..., 0] = (r << 3) | (r >> 2)
+  colors[..., 1] = (g << 2) | (g >> 4)
+  colors[..., 2] = (b << 3) | (b >> 2)
+  colors[..., 3] = 255
+  return colors
 
-def decode_rgba32_block(image_format, image_data, offset, block_data_size, colors):
-  pixel_color_data = []
+def _convert_rgb5a3_to_colors_vectorized(rgb5a3):
+  colors = np.empty(rgb5a3.shape + (4,), dtype=np.int32)
+  opaque = (rgb5a3 & 0x8000) != 0
   
-  for i in range(16):
-    a = read_u8(image_data, offset+(i*2))
-    r = read_u8(image_data, offset+(i*2)+1)
-    g = read_u8(image_data, offset+(i*2)+32)
-    b = read_u8(image_data, offset+(i*2)+33)
-    color = (r, g, b, a)
-    
-    pixel_color_data.append(color)
+  # Top bit is 0: 0AAARRRRGGGGBBBB
+  a3 = (rgb5a3 >> 12) & 0x7
+  r4 = (rgb5a3 >> 8) & 0xF
+  g4 = (rgb5a3 >> 4) & 0xF
+  b4 = (rgb5a3 >> 0) & 0xF
   
-  return pixel_color_data
+  # Top bit is 1: 1RRRRRGGGGGBBBBB (Alpha set to 0xff)
+  r5 = (rgb5a3 >> 10) & 0x1F
+  g5 = (rgb5a3 >> 5) & 0x1F
+  b5 = (rgb5a3 >> 0) & 0x1F
+  
+  colors[..., 0] = np.where(opaque, (r5 << 3) | (r5 >> 2), (r4 << 4) | r4)
+  colors[..., 1] = np.where(opaque, (g5 << 3) | (g5 >> 2), (g4 << 4) | g4)
+  colors[..., 2] = np.where(opaque, (b5 << 3) | (b5 >> 2), (b4 << 4) | b4)
+  colors[..., 3] = np.where(opaque, 255, (a3 << 5) | (a3 << 2) | (a3 >> 1))
+  return colors
 
-def decode_c4_block(image_format, image_data, offset, block_data_size, colors):
-  pixel_color_data = []
-  
-  for byte_index in range(block_data_size):
-    byte = read_u8(image_data, offset+byte_index)
-    for nibble_index in range(2):
-      color_index = (byte >> (1-nibble_index)*4) & 0xF
-      if color_index >= len(colors):
-        # This block bleeds past the edge of the image
-        color = None
-      else:
-        color = colors[color_index]
-      
-      pixel_color_data.append(color)
-  
-  return pixel_color_data
+# Every possible 16-bit color precomputed, so converting a block or palette of them is a single lookup.
+IA8_LUT = _convert_ia8_to_colors_vectorized(np.arange(0x10000)).astype(np.uint8)
+RGB565_LUT = _convert_rgb565_to_colors_vectorized(np.arange(0x10000)).astype(np.uint8)
+RGB5A3_LUT = _convert_rgb5a3_to_colors_vectorized(np.arange(0x10000)).astype(np.uint8)
 
-def decode_c8_block(image_format, image_data, offset, block_data_size, colors):
-  pixel_color_data = []
-  
-  for i in range(block_data_size):
-    color_index = read_u8(image_data, offset+i)
-    if color_index >= len(colors):
-      # This block bleeds past the edge of the image
-      color = None
-    else:
-      color = colors[color_index]
-    
-    pixel_color_data.append(color)
-  
-  return pixel_color_data
+# The same for the 4 and 8-bit intensity formats.
+I4_LUT = np.array([convert_i4_to_color(i4) for i4 in range(0x10)], dtype=np.uint8)
+I8_LUT = np.array([convert_i8_to_color(i8) for i8 in range(0x100)], dtype=np.uint8)
+IA4_LUT = np.array([convert_ia4_to_color(ia4) for ia4 in range(0x100)], dtype=np.uint8)
 
-def decode_c14x2_block(image_format, image_data, offset, block_data_size, colors):
-  pixel_color_data = []
-  
-  for i in range(block_data_size//2):
-    color_index = read_u16(image_data, offset+i*2) & 0x3FFF
-    if color_index >= len(colors):
-      # This block bleeds past the edge of the image
-      color = None
-    else:
-      color = colors[color_index]
-    
-    pixel_color_data.append(color)
-  
-  return pixel_color_data
+PALETTE_FORMAT_LUTS = {
+  PaletteFormat.IA8   : IA8_LUT,
+  PaletteFormat.RGB565: RGB565_LUT,
+  PaletteFormat.RGB5A3: RGB5A3_LUT,
+}
 
-def decode_cmpr_block(image_format, image_data, offset, block_data_size, colors):
-  pixel_color_data = [None]*64
-  
-  subblock_offset = offset
-  for subblock_index in range(4):
-    subblock_x = (subblock_index%2)*4
-    subblock_y = (subblock_index//2)*4
-    
-    color_0_rgb565 = read_u16(image_data, subblock_offset)
-    color_1_rgb565 = read_u16(image_data, subblock_offset+2)
-    colors = get_interpolated_cmpr_colors(color_0_rgb565, color_1_rgb565)
-    
-    color_indexes = read_u32(image_data, subblock_offset+4)
-    for i in range(16):
-      color_index = ((color_indexes >> ((15-i)*2)) & 3)
-      color = colors[color_index]
-      
-      x_in_subblock = i % 4
-      y_in_subblock = i // 4
-      pixel_index_in_block = subblock_x + subblock_y*8 + y_in_subblock*8 + x_in_subblock
-      
-      pixel_color_data[pixel_index_in_block] = color
-    
-    subblock_offset += 8
-  
-  return pixel_color_data
+def _decode_i4_block_vectorized(buf, offset, colors, out):
+  out[:] = I4_LUT[_read_u4_block_vectorized(buf, offset, out)]
+
+def _decode_i8_block_vectorized(buf, offset, colors, out):
+  out[:] = I8_LUT[_read_u8_block_vectorized(buf, offset, out)]
+
+def _decode_ia4_block_vectorized(buf, offset, colors, out):
+  out[:] = IA4_LUT[_read_u8_block_vectorized(buf, offset, out)]
+
+def _decode_ia8_block_vectorized(buf, offset, colors, out):
+  out[:] = IA8_LUT[_read_u16_block_vectorized(buf, offset, out)]
+
+def _decode_rgb565_block_vectorized(buf, offset, colors, out):
+  out[:] = RGB565_LUT[_read_u16_block_vectorized(buf, offset, out)]
+
+def _decode_rgb5a3_block_vectorized(buf, offset, colors, out):
+  out[:] = RGB5A3_LUT[_read_u16_block_vectorized(buf, offset, out)]
+
+def _decode_rgba32_block_vectorized(buf, offset, colors, out):
+  num_pixels = math.prod(out.shape[:-1])
+  # Each block stores its 16 pixels' AR pairs, followed by their GB pairs.
+  ar_gb = np.frombuffer(buf, dtype=np.uint8, count=num_pixels*4, offset=offset).reshape(-1, 2, 16, 2)
+  out[..., 0] = ar_gb[:, 0, :, 1].reshape(out.shape[:-1])
+  out[..., 1] = ar_gb[:, 1, :, 0].reshape(out.shape[:-1])
+  out[..., 2] = ar_gb[:, 1, :, 1].reshape(out.shape[:-1])
+  out[..., 3] = ar_gb[:, 0, :, 0].reshape(out.shape[:-1])
+
+def _decode_c4_block_vectorized(buf, offset, colors, out):
+  out[:] = _pad_palette_vectorized(colors, 0x10)[_read_u4_block_vectorized(buf, offset, out)]
+
+def _decode_c8_block_vectorized(buf, offset, colors, out):
+  out[:] = _pad_palette_vectorized(colors, 0x100)[_read_u8_block_vectorized(buf, offset, out)]
+
+def _decode_c14x2_block_vectorized(buf, offset, colors, out):
+  out[:] = _pad_palette_vectorized(colors, 0x4000)[_read_u16_block_vectorized(buf, offset, out) & 0x3FFF]
+
+# Shift amounts to pull the 2-bit color indexes for each of the 16 pixels out of a sub-block's index word.
+CMPR_COLOR_INDEX_SHIFTS = np.arange(30, -1, -2, dtype=np.uint32)
+
+def _decode_cmpr_block_vectorized(buf, offset, colors, out):
+  num_blocks = math.prod(out.shape[:-3])
+  # Each row is one 4x4 sub-block: color_0, color_1, and the two halves of the color index word.
+  subblocks = np.frombuffer(buf, dtype=">u2", count=num_blocks*16, offset=offset).reshape(num_blocks, 4, 4)
+  color_0_rgb565 = subblocks[..., 0]
+  color_1_rgb565 = subblocks[..., 1]
+  color_indexes = (subblocks[..., 2].astype(np.uint32) << 16) | subblocks[..., 3]
+  
+  # Indexed by block, sub-block, color index, and channel.
+  cmpr_colors = np.empty((num_blocks, 4, 4, 4), dtype=np.int32)
+  cmpr_colors[:, :, 0] = _convert_rgb565_to_colors_vectorized(color_0_rgb565)
+  cmpr_colors[:, :, 1] = _convert_rgb565_to_colors_vectorized(color_1_rgb565)
+  rgb0 = cmpr_colors[:, :, 0, :3]
+  rgb1 = cmpr_colors[:, :, 1, :3]
+  four_color_mode = color_0_rgb565 > color_1_rgb565
+  cmpr_colors[:, :, 2, :3] = np.where(four_color_mode[..., None], (2*rgb0 + 1*rgb1)//3, rgb0//2 + rgb1//2)
+  cmpr_colors[:, :, 3, :3] = np.where(four_color_mode[..., None], (1*rgb0 + 2*rgb1)//3, 0)
+  cmpr_colors[:, :, 2, 3] = 255
+  cmpr_colors[:, :, 3, 3] = np.where(four_color_mode, 255, 0)
+  
+  pixel_color_indexes = (color_indexes[..., None] >> CMPR_COLOR_INDEX_SHIFTS) & 3
+  subblock_pixels = np.take_along_axis(cmpr_colors, pixel_color_indexes[..., None].astype(np.intp), axis=2)
+  
+  # The sub-blocks are arranged 2x2 within each 8x8 block.
+  out[:] = subblock_pixels.reshape(num_blocks, 2, 2, 4, 4, 4).transpose(0, 1, 3, 2, 4, 5).reshape(out.shape)
+
+VECTORIZED_BLOCK_DECODERS = {
+  ImageFormat.I4    : _decode_i4_block_vectorized,
+  ImageFormat.I8    : _decode_i8_block_vectorized,
+  ImageFormat.IA4   : _decode_ia4_block_vectorized,
+  ImageFormat.IA8   : _decode_ia8_block_vectorized,
+  ImageFormat.RGB565: _decode_rgb565_block_vectorized,
+  ImageFormat.RGB5A3: _decode_rgb5a3_block_vectorized,
+  ImageFormat.RGBA32: _decode_rgba32_block_vectorized,
+  ImageFormat.C4    : _decode_c4_block_vectorized,
+  ImageFormat.C8    : _decode_c8_block_vectorized,
+  ImageFormat.C14X2 : _decode_c14x2_block_vectorized,
+  ImageFormat.CMPR  : _decode_cmpr_block_vectorized,
+}
 
 class InvalidOffsetError(Exception):
   pass
@@ -574,7 +461,22 @@ def write_u16(data, offset, new_value):
   data.seek(offset)
   data.write(new_value)
 
-PY_FAST_YAZ0_INSTALLED = False
+try:
+  import pyfastyaz0
+  PY_FAST_YAZ0_INSTALLED = True
+except ImportError:
+  PY_FAST_YAZ0_INSTALLED = False
+
+# Importing Numba and loading the compiled decompressor costs about as much as decompressing 2 MB in Python.
+YAZ0_NUMBA_MIN_SIZE = 0x200000
+
+def try_import_bti_numba():
+  # Numba can be installed but still fail to import, e.g. when it doesn't support the installed version of NumPy.
+  try:
+    import _bti_numba
+  except ImportError:
+    return None
+  return _bti_numba
 
 class Yaz0:
   @staticmethod
@@ -595,7 +497,20 @@ class Yaz0:
     
     comp = read_all_bytes(comp_data)
     
-    output = []
+    if PY_FAST_YAZ0_INSTALLED:
+      uncomp_data = bytes(pyfastyaz0.decompress(comp))
+      return BytesIO(uncomp_data)
+    
+    if BTI_FAST_INSTALLED:
+      uncomp_data = _bti_fast.yaz0_decompress(comp, uncomp_size)
+      return BytesIO(uncomp_data)
+    
+    bti_numba = try_import_bti_numba() if NUMBA_INSTALLED and uncomp_size >= YAZ0_NUMBA_MIN_SIZE else None
+    if bti_numba is not None:
+      uncomp_data = bti_numba.decompress_yaz0(np.frombuffer(comp, dtype=np.uint8), uncomp_size).tobytes()
+      return BytesIO(uncomp_data)
+    
+    output = bytearray(uncomp_size)
     output_len = 0
     src_offset = 0x10
     valid_bit_count = 0
@@ -607,7 +522,7 @@ class Yaz0:
         valid_bit_count = 8
       
       if curr_code_byte & 0x80 != 0:
-        output.append(comp[src_offset])
+        output[output_len] = comp[src_offset]
         src_offset += 1
         output_len += 1
       else:
@@ -625,20 +540,31 @@ class Yaz0:
           num_bytes += 2
         
         for i in range(0, num_bytes):
-          output.append(output[copy_src_offset])
+          output[output_len] = output[copy_src_offset]
           output_len += 1
           copy_src_offset += 1
       
       curr_code_byte = (curr_code_byte << 1)
       valid_bit_count -= 1
     
-    uncomp_data = struct.pack("B"*output_len, *output)
-    
-    return BytesIO(uncomp_data)
+    return BytesIO(output)
 
-# Simple script wrapper to decode a BTI image
+# Simple script wrapper to decode BTI images. It takes any number of paths, so that decoding a batch of images only
+# pays for starting Python and importing NumPy once.
 if __name__ == '__main__':
-    print("DECODE BTI " + sys.argv[1])
-    file_data = open(sys.argv[1], "rb")
-    bti = BTIFile(file_data)
-    bti.render().save(sys.argv[1] + ".png", "PNG")
+    any_failed = False
+    for path in sys.argv[1:]:
+        print("DECODE BTI " + path)
+        png_path = path + ".png"
+        try:
+            with open(path, "rb") as file_data:
+                bti = BTIFile(file_data)
+                bti.render().save(png_path, "PNG")
+        except Exception:
+            # Keep going with the rest of the batch. extract_iso.sh only deletes BTI files that have a PNG,
+            # so don't leave a partly written one behind.
+            traceback.print_exc()
+            any_failed = True
+            if os.path.exists(png_path):
+                os.remove(png_path)
+    sys.exit(1 if any_failed else 0)
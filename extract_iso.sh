@@ -11,7 +11,10 @@ cp -r ./p2filesystem/P-GPVE/files/user/Matoba/resulttex/* ./assets/resulttex
 cp ./p2filesystem/P-GPVE/files/user/Yamashita/enemytex/arc.szs ./assets/enemytex
 cp ./p2filesystem/P-GPVE/files/user/Abe/Pellet/us/pelletlist_us.szs ./assets/cfg
 find ./assets -iname "*.szs" -execdir wszst EXTRACT {} \; -delete
-find ./assets -iname "*.bti" -exec python3 extract_bti.py {} \; -delete
+# Decode the BTI images in batches, so Python starts up and imports NumPy once per batch instead of once per image.
+# A failed image doesn't stop the rest, and only the BTI files that were decoded into a PNG are deleted.
+find ./assets -iname "*.bti" -exec python3 extract_bti.py {} + || true
+find ./assets -iname "*.bti" -exec test -f {}.png \; -delete
 find ./assets -iname "wszst-setup.txt" -delete
 find ./assets -iname "*.bmd" -delete
 rm -rf ./p2filesystem